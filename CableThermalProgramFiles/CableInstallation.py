@@ -16,6 +16,7 @@ class Installation:
         """
         self.cable_list = []
         self.num_cables = 0
+        self.group_list = []
         self.soil = self.Soil(thermalResistivity)
         self.ambTemp = ambTemp
 
@@ -38,6 +39,49 @@ class Installation:
         self.cable_list.append(cable)
         self.num_cables += 1
 
+    def addGroup(self, group):
+        """
+        Adds a cable group (circuit) to the installation. Each conductor of the group is added as a cable
+        :param group: cable group object
+        :return:
+        """
+        self.group_list.append(group)
+        for cable in group.cable_list:
+            self.addCable(cable)
+
+    def coarsen(self, factor):
+        """
+        Creates a copy of the installation with every cable re-discretized at a coarser point source spacing.
+        Used to compute a cheap starting point for the full resolution calculation.
+        :param factor: multiplier applied to the deltaL of each cable
+        :return: coarse installation object
+        """
+        coarseInstallation = Installation(ambTemp=self.ambTemp, thermalResistivity=self.soil.thermalResistivity)
+
+        for group in self.group_list:
+            coarseInstallation.addGroup(group.coarsen(factor))
+
+        # Conductors of groups in the group list are coarsened with their group
+        for cable in self.cable_list:
+            if cable.group is None or cable.group not in self.group_list:
+                coarseInstallation.addCable(cable.coarsen(factor))
+
+        return coarseInstallation
+
+    def prolongate(self, coarseInstallation):
+        """
+        Interpolates the section temperatures and watt losses of a (converged) coarse installation onto the cables of
+        this installation. Cables are matched by cableID.
+        :param coarseInstallation: installation object created by coarsen()
+        :return: None
+        """
+        coarseCables = {cable.cableID: cable for cable in coarseInstallation.cable_list}
+
+        for cable in self.cable_list:
+            cable.prolongate(coarseCables[cable.cableID])
+
+        return
+
     def plot(self):
         """
         Function to create a 3D plot of the cables in the installatin
@@ -127,6 +171,9 @@ class Cable:
         self.sheathLossFactor=sheathLossFactor
         self.armorLossFactor=armorLossFactor
 
+        # Cable group (circuit) the cable is a conductor of. None if the cable is not part of a group
+        self.group = None
+
 
     class Segment:
         def __init__(self, startX: float, endX: float, startY: float, endY: float, startZ: float, endZ: float, deltaL: float):
@@ -273,6 +320,50 @@ class Cable:
 
         return
 
+    def sectionPositions(self):
+        """
+        Distance along the cable route to each point source (start of each section). Units of meter
+        :return: numpy array of positions matching the cable coordinate array
+        """
+        return np.cumsum(self.cablecoords[3]) - self.cablecoords[3]
+
+    def coarsen(self, factor):
+        """
+        Creates a copy of the cable with the same properties and route, re-discretized with a deltaL that is factor
+        times larger.
+        :param factor: multiplier applied to the cable deltaL
+        :return: coarse cable object
+        """
+        firstSegm = self.segm_array[0]
+        coarseCable = Cable(current=self.current, deltaL=self.deltaL * factor, startx=firstSegm.startX,
+                            starty=firstSegm.startY, startz=firstSegm.startZ, cableID=self.cableID,
+                            insulationTR=self.insulationTR, armorBeddingTR=self.armorBeddingTR, jacketTR=self.jacketTR,
+                            sheathLossFactor=self.sheathLossFactor, armorLossFactor=self.armorLossFactor,
+                            conductorMaterial=self.conductorMaterial, insulationSystem=self.insulationSystem,
+                            conductorDiameter=self.conductorDiameter,
+                            conductorDCResistance20=self.conductorDCResistance20, frequency=self.frequency)
+
+        # Follow the same route as the original cable
+        for segment in self.segm_array:
+            coarseCable.addSegment(segment.endX, segment.endY, segment.endZ)
+
+        return coarseCable
+
+    def prolongate(self, coarseCable):
+        """
+        Sets the section temperatures and watt losses of the cable by linearly interpolating the results of a coarse
+        copy of the cable along the cable route.
+        :param coarseCable: cable object created by coarsen()
+        :return: None
+        """
+        finePositions = self.sectionPositions()
+        coarsePositions = coarseCable.sectionPositions()
+
+        self.sectionCableTemp = np.interp(finePositions, coarsePositions, coarseCable.sectionCableTemp)
+        self.sectionWattLosses = np.interp(finePositions, coarsePositions, coarseCable.sectionWattLosses)
+
+        return
+
     def updateSkinEffectFactor(self, dcResistanceOperatingTemp):
         #Calculations from section 2.1.2 Skin Effect Factor Ys from IEC 60287
         p1 = 8*math.pi*self.frequency*0.0000001*iec60287_Table2["SkinFactor"][self.conductorMaterial][self.insulationSystem]
@@ -295,7 +386,7 @@ class Cable:
         p3 = 0.312+(1.18)/((p2)+0.27)
         return p2*p3
 
-    def updateResistance(self):
+    def updateResistance(self, sectionCableTemp=None):
         """
         dcResistanceOperatingTemp = DC resistance of the conductor at operating temp (ohms/m).
         dcResistance20 = DC resistance of the conductor at 20degC (ohms/m). Derived from IEC 60228
@@ -303,6 +394,7 @@ class Cable:
         maxOpTemp = cable's maximum operating temperature
         skinfactor = skin effect factor. Table 2 of IEC 60287. AL Round Stranded and AL Round Solid is 1.
         proximityfactor = proximity effect factor. Table 2. AL Round Stranded is 0.8. AL Round Solid is 1.
+        :param sectionCableTemp: section temperatures to calculate the resistance at. defaults to the cable section temperatures
         :return:
         """
         #Updates the AC resistance of a cable
@@ -312,9 +404,12 @@ class Cable:
         dcResistance20 = self.conductorDCResistance20
         constMassTemp = iec60287_Table1["TempCoeff"]["Conductor"][self.conductorMaterial]
 
+        if sectionCableTemp is None:
+            sectionCableTemp = self.sectionCableTemp
+
         #update DC resistance based on the section operating temperatures
         dcResistanceOperatingTemp = np.zeros_like(self.sectionWattLosses)
-        dcResistanceOperatingTemp = dcResistance20 * (1 + constMassTemp * (self.sectionCableTemp - 20))
+        dcResistanceOperatingTemp = dcResistance20 * (1 + constMassTemp * (sectionCableTemp - 20))
         #print(self.cableID, ": DC Resistance @ 20degC (ohm/m) :", dcResistance20)
         #print(self.cableID, ": DC Resistance @", self.sectionCableTemp[0],"degC (ohm/m) :", dcResistanceOperatingTemp[0])
 
@@ -334,3 +429,184 @@ class Cable:
         #Update watt losses of each segment (units of W/m)
         self.sectionWattLosses = self.current * self.current * sectionResistance
         #print(self.cableID,": Section Watt Loss (W/m) :",self.sectionWattLosses[0])
+
+
+#Contains the conductors of a circuit that share one cable route
+class CableGroup:
+    def __init__(self, groupID: str, offsets: list, current: float, deltaL: float, startx: float, starty: float,
+                 startz: float, cableIDs: list = None, farFieldFactor: float = 10, **cableProperties):
+        '''
+        Cable group object. Stores a circuit of conductors (eg. the two poles of a DC circuit) that follow the same
+        route at fixed offsets from each other and carry the same current. The route is built once with addSegment.
+        Conductors of the group are calculated exactly against each other. Cables outside of the group that are further
+        than farFieldDistance from a point of the group route see the group as a single equivalent source at the route.
+        :param groupID: ID of the group. Should not be the same group ID in the same installation
+        :param offsets: list of (x, y, z) offsets of each conductor from the group route at the start of the route
+                        (unit of meter). Must be perpendicular to the first route segment. The offsets turn with the route
+        :param current: current of each conductor in amps
+        :param deltaL: line source length (unit of meter)
+        :param startx: starting x coordinate of the group route (Axis unit of meter)
+        :param starty: starting y coordinate of the group route (depth) (Axis unit of meter)
+        :param startz: starting z coordinate of the group route (Axis unit of meter)
+        :param cableIDs: list of cable IDs of the conductors. defaults to groupID_1, groupID_2, ...
+        :param farFieldFactor: far field distance as a multiple of the largest conductor offset from the group centre. default 10
+        :param cableProperties: remaining Cable arguments (insulationTR, conductorMaterial, ...) shared by all conductors
+        '''
+        self.groupID = groupID
+        self.offsets = offsets
+        self.current = current
+        self.deltaL = deltaL
+        self.farFieldFactor = farFieldFactor
+        self.cableProperties = cableProperties
+
+        if cableIDs is None:
+            cableIDs = [groupID + "_" + str(n + 1) for n in range(len(offsets))]
+        if len(cableIDs) != len(offsets):
+            raise ValueError("Cable group " + groupID + " has " + str(len(cableIDs)) + " cable IDs for "
+                             + str(len(offsets)) + " conductor offsets")
+        self.cableIDs = cableIDs
+
+        # Route points of the group
+        self.route = [(startx, starty, startz)]
+
+        # Offsets of each conductor, and of the group centre (last row), for the last segment of the route
+        offsetArray = np.array(offsets, dtype=np.float64)
+        centreOffset = np.mean(offsetArray, axis=0)
+        self.offsetVectors = np.vstack((offsetArray, centreOffset))
+
+        # Create a cable for each conductor of the group
+        self.cable_list = []
+        for cableID, (offsetX, offsetY, offsetZ) in zip(cableIDs, offsets):
+            cable = Cable(current=current, deltaL=deltaL, startx=startx + offsetX, starty=starty + offsetY,
+                          startz=startz + offsetZ, cableID=cableID, **cableProperties)
+            cable.group = self
+            self.cable_list.append(cable)
+
+        # Line through the centre of the conductors. Holds the point sources of the equivalent source
+        # Not added to the installation
+        self.centre = Cable(current=0, deltaL=deltaL, startx=startx + centreOffset[0], starty=starty + centreOffset[1],
+                            startz=startz + centreOffset[2], cableID=groupID, **cableProperties)
+
+        # Index of the nearest centre point source for each conductor point source {cableID: array}
+        self.centreIndex = {}
+
+        # Distance beyond which the group is treated as a single equivalent source
+        # Measured from the centre of the conductors, which is where the equivalent source is placed
+        groupRadius = np.max(np.linalg.norm(offsetArray - centreOffset, axis=1))
+        self.farFieldDistance = farFieldFactor * groupRadius
+
+        # Equivalent source of the group. [x],[y],[z],[deltaL * watt loss summed over the conductors]
+        # None until updateEquivalentSource is called
+        self.sourcecoords = None
+
+    def addSegment(self, endX, endY, endZ) -> None:
+        """
+        Adds a new segment to the group route. A segment is added to every conductor at the conductor offset. At a bend
+        the offsets are rotated with the route, and the conductors are joined at mitred corners so they keep their
+        spacing on both sides of the bend
+        :param endX: ending x coordinate of the route segment
+        :param endY: ending y coordinate of the route segment (depth)
+        :param endZ: ending z coordinate of the route segment
+        :return: none
+        """
+        routeHead = np.array(self.route[-1], dtype=np.float64)
+        routeEnd = np.array((endX, endY, endZ), dtype=np.float64)
+        length = np.linalg.norm(routeEnd - routeHead)
+        if length == 0:
+            raise ValueError("Cable group " + self.groupID + " segment has zero length")
+        direction = (routeEnd - routeHead) / length
+
+        cables = self.cable_list + [self.centre]
+
+        if len(self.route) == 1:
+            # Offsets are given in the cross section of the first segment
+            if np.any(np.absolute(self.offsetVectors @ direction) > 1e-6):
+                raise ValueError("Cable group " + self.groupID + " offsets must be perpendicular to the first segment")
+            for cable, offset in zip(cables, self.offsetVectors):
+                cable.addSegment(*(routeEnd + offset))
+        else:
+            previousDirection = self.direction
+
+            # Rotate the offsets by the smallest rotation that turns the previous segment direction into the new one
+            axis = np.cross(previousDirection, direction)
+            cosAngle = np.dot(previousDirection, direction)
+            if cosAngle <= -1 + 1e-9:
+                raise ValueError("Cable group " + self.groupID + " route cannot turn back on itself")
+            crossMatrix = np.array([[0, -axis[2], axis[1]], [axis[2], 0, -axis[0]], [-axis[1], axis[0], 0]])
+            rotation = np.eye(3) + crossMatrix + crossMatrix @ crossMatrix / (1 + cosAngle)
+            offsetVectors = self.offsetVectors @ rotation.T
+
+            for cable, offset, newOffset in zip(cables, self.offsetVectors, offsetVectors):
+                lastSegm = cable.segm_array[-1]
+                segmStart = np.array((lastSegm.startX, lastSegm.startY, lastSegm.startZ))
+                segmEnd = routeEnd + newOffset
+
+                # Mitred corner. Intersection of the conductor lines before and after the bend
+                if np.linalg.norm(axis) < 1e-9:
+                    corner = routeHead + offset
+                else:
+                    (s, u), *_ = np.linalg.lstsq(np.column_stack((previousDirection, -direction)),
+                                                 newOffset - offset, rcond=None)
+                    corner = routeHead + offset + s * previousDirection
+                if np.dot(corner - segmStart, previousDirection) <= 0 or np.dot(segmEnd - corner, direction) <= 0:
+                    raise ValueError("Cable group " + self.groupID + " segments are too short for the conductor offsets at the bend")
+
+                # Move the end of the previous conductor segment to the corner
+                cable.segm_array.pop()
+                cable.num_segm -= 1
+                cable.cableHeadX, cable.cableHeadY, cable.cableHeadZ = segmStart
+                cable.addSegment(*corner)
+                cable.addSegment(*segmEnd)
+
+            self.offsetVectors = offsetVectors
+
+        self.direction = direction
+        self.route.append((endX, endY, endZ))
+
+        # Map each conductor point source to the centre point source at the same fraction of the route
+        centreFraction = (self.centre.sectionPositions() + self.centre.cablecoords[3] / 2) / np.sum(self.centre.cablecoords[3])
+        for cable in self.cable_list:
+            fraction = (cable.sectionPositions() + cable.cablecoords[3] / 2) / np.sum(cable.cablecoords[3])
+            centrePoints = np.arange(centreFraction.shape[0])
+            self.centreIndex[cable.cableID] = np.rint(np.interp(fraction, centreFraction, centrePoints)).astype(int)
+
+        return
+
+    def coarsen(self, factor):
+        """
+        Creates a copy of the group with the same conductors and route, re-discretized with a deltaL that is factor
+        times larger.
+        :param factor: multiplier applied to the group deltaL
+        :return: coarse cable group object
+        """
+        startx, starty, startz = self.route[0]
+        coarseGroup = CableGroup(groupID=self.groupID, offsets=self.offsets, current=self.current,
+                                 deltaL=self.deltaL * factor, startx=startx, starty=starty, startz=startz,
+                                 cableIDs=self.cableIDs, farFieldFactor=self.farFieldFactor, **self.cableProperties)
+
+        for endX, endY, endZ in self.route[1:]:
+            coarseGroup.addSegment(endX, endY, endZ)
+
+        # Currents may have been changed on the individual conductors after the group was created
+        for coarseCable, cable in zip(coarseGroup.cable_list, self.cable_list):
+            coarseCable.current = cable.current
+
+        return coarseGroup
+
+    def updateEquivalentSource(self) -> None:
+        """
+        Updates the equivalent source of the group from the current conductor watt losses. The equivalent source is
+        located on the line through the centre of the conductors. Its strength is the centre deltaL times the sum of the
+        conductor watt losses at the same fraction of the route. Should be called after the conductor watt losses are updated.
+        :return: None
+        """
+        centreFraction = (self.centre.sectionPositions() + self.centre.cablecoords[3] / 2) / np.sum(self.centre.cablecoords[3])
+
+        self.sourcecoords = self.centre.cablecoords.copy()
+        self.sourcecoords[3] = 0
+        for cable in self.cable_list:
+            fraction = (cable.sectionPositions() + cable.cablecoords[3] / 2) / np.sum(cable.cablecoords[3])
+            self.sourcecoords[3] += np.interp(centreFraction, fraction, cable.sectionWattLosses)
+        self.sourcecoords[3] *= self.centre.cablecoords[3]
+
+        return
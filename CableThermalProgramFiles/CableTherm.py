@@ -11,13 +11,158 @@ class CableThermalCalculation:
     Collection of functions to calculate thermal rise in cable installations
     """
 
-    def __init__(self, installation, xOffset=0, yOffset=-0.05, zOffset=0):
+    def __init__(self, installation, xOffset=0, yOffset=-0.05, zOffset=0, coarseFactor=1, coarseLevels=1):
         """
         Init statement to calculate the deltaT
+        :param coarseFactor: if greater than 1, the installation is first solved with point sources coarseFactor times
+        further apart and the result is used as the starting point of the full resolution calculation. default 1
+        :param coarseLevels: number of coarse resolutions solved before the full resolution. Each level is coarseFactor
+        times coarser than the next. default 1
         """
+        if coarseFactor > 1 and coarseLevels >= 1:
+            self.coarseToFineEqn(installation, coarseFactor, coarseLevels)
         self.results = self.deltaTEqn(installation, xOffset, yOffset, zOffset)
         self.installation = installation
 
+    def coarseToFineEqn(self, installation, coarseFactor, coarseLevels=1, coarseConvReq=0.5):
+        """
+        Sets the starting temperatures and watt losses of the installation cables from coarse solutions of the same
+        cable routes. The coarsest installation is solved first, and each result is interpolated onto the next finer
+        installation as its starting point, ending with the user's installation. The user's installation still needs
+        to be solved with deltaTEqn. The coarse temperatures run several degrees lower than the full resolution result,
+        because the sum over the neighbouring point sources depends on deltaL, so the saving is limited.
+        :param installation: installation object to initialize
+        :param coarseFactor: ratio of point source spacing between consecutive resolutions
+        :param coarseLevels: number of coarse resolutions to solve. Nothing is done if less than 1. default 1
+        :param coarseConvReq: convergence requirement of each coarse calculation. The coarse results are only a starting
+        point, so this is looser than the full resolution requirement. defaults to 0.5
+        :return: None
+        """
+        if coarseLevels < 1:
+            return None
+
+        prevInstallation = None
+
+        # Step from the coarsest resolution towards the full resolution
+        for level in range(coarseLevels, 0, -1):
+            print("coarse level: ", level)
+            coarseInstallation = installation.coarsen(coarseFactor ** level)
+
+            # Start from the result of the previous (coarser) level
+            if prevInstallation is not None:
+                coarseInstallation.prolongate(prevInstallation)
+
+            self.deltaTEqn(coarseInstallation, convReq=coarseConvReq)
+            prevInstallation = coarseInstallation
+
+        installation.prolongate(prevInstallation)
+
+        for cable in installation.cable_list:
+            if not np.all(np.isfinite(cable.sectionCableTemp)):
+                raise ValueError("Coarse to fine starting temperatures of " + cable.cableID + " are not finite")
+
+        return None
+
+    def cableThermalResistance(self, cable):
+        """
+        Thermal resistance between the conductor and the cable surface, Tcab. (unit of K.m/W)
+        :param cable: cable object
+        :return: Float
+        """
+        return (cable.insulationTR + (1 + cable.sheathLossFactor) * cable.armorBeddingTR + (1 + cable.sheathLossFactor + cable.armorLossFactor) * cable.jacketTR)
+
+    def groupPairDeltaTemp(self, groupI, groupJ):
+        """
+        Calculates the sum of (1/r+ - 1/r-) * deltaL * watt loss of cable group J at each point of the conductors of
+        cable group I. Where a point of the group J route is further than the farFieldDistance of both groups from the
+        group I route point, the term and its gradient are calculated once at the group I centre and applied to every
+        conductor of group I at its offset from the nearest centre point. The remaining (near) points are calculated exactly for each pair of conductors.
+        :param groupI: cable group object the temperature increase is calculated for
+        :param groupJ: cable group object causing the temperature increase. Both groups need up to date equivalent sources
+        :return: dictionary of numpy arrays of the summed terms at each point of each group I conductor {cableID: array}
+        """
+        centre = groupI.sourcecoords
+        source = groupJ.sourcecoords
+        farFieldDistance = max(groupI.farFieldDistance, groupJ.farFieldDistance)
+        deltaTemps = {cableI.cableID: np.zeros(cableI.cablecoords.shape[1], dtype=np.float64) for cableI in groupI.cable_list}
+
+        # Calculate the far field for blocks of group I route points at a time
+        for start in range(0, centre.shape[1], 256):
+            rows = slice(start, start + 256)
+            dx = centre[0][rows, None] - source[0]
+            dyPlus = centre[1][rows, None] - source[1]
+            dyMinus = centre[1][rows, None] + source[1]
+            dz = centre[2][rows, None] - source[2]
+            r_plus = np.sqrt(dx ** 2 + dyPlus ** 2 + dz ** 2)
+            r_minus = np.sqrt(dx ** 2 + dyMinus ** 2 + dz ** 2)
+
+            # Far field of both groups. Use the equivalent sources
+            near = r_plus <= farFieldDistance
+            nearRows = near.any(axis=1)
+            farStrength = np.where(near, 0, source[3])
+            farDeltaTemp = np.sum((1 / r_plus - 1 / r_minus) * farStrength, axis=1)
+
+            # Gradient of the far field at the group I centre. The far field varies linearly across the group I
+            # conductors, which would otherwise make the outer conductors equal to the centre
+            r_plus3 = r_plus ** 3
+            r_minus3 = r_minus ** 3
+            gradX = np.sum(dx * (1 / r_minus3 - 1 / r_plus3) * farStrength, axis=1)
+            gradY = np.sum((dyMinus / r_minus3 - dyPlus / r_plus3) * farStrength, axis=1)
+            gradZ = np.sum(dz * (1 / r_minus3 - 1 / r_plus3) * farStrength, axis=1)
+
+            for cableI in groupI.cable_list:
+                # Points of conductor I whose nearest centre point is in this block
+                centreIndex = groupI.centreIndex[cableI.cableID]
+                points = np.flatnonzero((centreIndex >= start) & (centreIndex < start + 256))
+                k = centreIndex[points] - start
+                deltaTemps[cableI.cableID][points] += (farDeltaTemp[k]
+                                                       + gradX[k] * (cableI.cablecoords[0][points] - centre[0][start + k])
+                                                       + gradY[k] * (cableI.cablecoords[1][points] - centre[1][start + k])
+                                                       + gradZ[k] * (cableI.cablecoords[2][points] - centre[2][start + k]))
+
+                # Near field. Use the individual conductors
+                for i, kNear in zip(points[nearRows[k]], k[nearRows[k]]):
+                    for cableJ in groupJ.cable_list:
+                        coords = cableJ.cablecoords[:, near[kNear][groupJ.centreIndex[cableJ.cableID]]]
+                        wattLosses = cableJ.sectionWattLosses[near[kNear][groupJ.centreIndex[cableJ.cableID]]]
+                        r_plus_near = np.sqrt((cableI.cablecoords[0][i] - coords[0]) ** 2 + (cableI.cablecoords[1][i] - coords[1]) ** 2 + (cableI.cablecoords[2][i] - coords[2]) ** 2)
+                        r_minus_near = np.sqrt((cableI.cablecoords[0][i] - coords[0]) ** 2 + (cableI.cablecoords[1][i] + coords[1]) ** 2 + (cableI.cablecoords[2][i] - coords[2]) ** 2)
+                        deltaTemps[cableI.cableID][i] += np.sum((1 / r_plus_near - 1 / r_minus_near) * coords[3] * wattLosses)
+
+        return deltaTemps
+
+    def groupDeltaTemp(self, cableI, group):
+        """
+        Calculates the sum of (1/r+ - 1/r-) * deltaL * watt loss of a cable group at each point of cableI. Points of the
+        group route further than the group's farFieldDistance from the cableI point are included through the group
+        equivalent source. The remaining (near) points are calculated exactly for each conductor of the group.
+        :param cableI: cable object the temperature increase is calculated for. Not a conductor of the group
+        :param group: cable group object with an up to date equivalent source
+        :return: numpy array of the summed terms at each point of cableI
+        """
+        deltaTemp = np.zeros(cableI.cablecoords.shape[1], dtype=np.float64)
+        source = group.sourcecoords
+
+        for i in range(deltaTemp.shape[0]):
+            r_plus = np.sqrt((cableI.cablecoords[0][i] - source[0]) ** 2 + (cableI.cablecoords[1][i] - source[1]) ** 2 + (cableI.cablecoords[2][i] - source[2]) ** 2)
+            r_minus = np.sqrt((cableI.cablecoords[0][i] - source[0]) ** 2 + (cableI.cablecoords[1][i] + source[1]) ** 2 + (cableI.cablecoords[2][i] - source[2]) ** 2)
+
+            # Far field of the group. Use the equivalent source
+            far = r_plus > group.farFieldDistance
+            deltaTemp[i] += np.sum((1 / r_plus[far] - 1 / r_minus[far]) * source[3][far])
+
+            # Near field of the group. Use the individual conductors at the near centre points
+            near = ~far
+            if not near.any():
+                continue
+            for cableJ in group.cable_list:
+                nearJ = near[group.centreIndex[cableJ.cableID]]
+                coords = cableJ.cablecoords[:, nearJ]
+                r_plus = np.sqrt((cableI.cablecoords[0][i] - coords[0]) ** 2 + (cableI.cablecoords[1][i] - coords[1]) ** 2 + (cableI.cablecoords[2][i] - coords[2]) ** 2)
+                r_minus = np.sqrt((cableI.cablecoords[0][i] - coords[0]) ** 2 + (cableI.cablecoords[1][i] + coords[1]) ** 2 + (cableI.cablecoords[2][i] - coords[2]) ** 2)
+                deltaTemp[i] += np.sum((1 / r_plus - 1 / r_minus) * coords[3] * cableJ.sectionWattLosses[nearJ])
+
+        return deltaTemp
 
     def deltaTEqn(self, installation, xOffset=0, yOffset=-0.05, zOffset=0, convReq=0.1):
         """
@@ -61,6 +206,19 @@ class CableThermalCalculation:
             for cable in installation.cable_list:
                 cable.updateConductorWattLoss()
 
+            #Update the equivalent source of each cable group from the new watt losses
+            for group in installation.group_list:
+                group.updateEquivalentSource()
+
+            #Thermal impact between cable groups. The watt losses are fixed during the iteration, so it is calculated
+            #once here for every conductor of each group
+            groupDeltaTemps = {}
+            for groupI in installation.group_list:
+                for groupJ in installation.group_list:
+                    if groupJ is not groupI and groupI.sourcecoords is not None and groupJ.sourcecoords is not None:
+                        for cableID, dt in self.groupPairDeltaTemp(groupI, groupJ).items():
+                            groupDeltaTemps[cableID] = groupDeltaTemps.get(cableID, 0) + dt
+
             #Loop through each cable in the installation and calculate the temperature increase for each cable
             for cableI in installation.cable_list:
                 # Placeholder deltaTemp array for intermediary calcs
@@ -77,8 +235,21 @@ class CableThermalCalculation:
                 r_plus = np.zeros(cableI.cablecoords.shape[1], dtype=np.float64)
                 r_minus = np.zeros(cableI.cablecoords.shape[1], dtype=np.float64)
 
+                # Thermal impact of the cable groups that cableI is not a conductor of
+                if cableI.group is not None and cableI.group.sourcecoords is not None and cableI.group in installation.group_list:
+                    if cableI.cableID in groupDeltaTemps:
+                        deltaTemp += groupDeltaTemps[cableI.cableID]
+                else:
+                    for group in installation.group_list:
+                        if group is not cableI.group and group.sourcecoords is not None:
+                            deltaTemp += self.groupDeltaTemp(cableI, group)
+
                 # Step through each cable in the installation and calculate the temp increase at the cable+specified offset
                 for cableJ in installation.cable_list:
+                    # Conductors of other cable groups were included with their group
+                    if cableJ.group in installation.group_list and cableJ.group is not cableI.group and cableJ.group.sourcecoords is not None:
+                        continue
+
                     #Check if cableI and cableJ are the same
                     #If they are not the same proceed with the following code
                     #Thermal impact of CableJ on Cable I
@@ -155,6 +326,251 @@ class CableThermalCalculation:
 
         return None
 
+    def installationArrays(self):
+        """
+        Combines the point sources of all cables in the installation into single arrays, in cable_list order.
+        :return: coordinate array [[x],[y],[z],[deltaL]], list of (cable, slice) pairs locating each cable in the arrays
+        """
+        installation = self.installation
+        cableSlices = []
+        start = 0
+        for cable in installation.cable_list:
+            cableSlices.append((cable, slice(start, start + cable.cablecoords.shape[1])))
+            start += cable.cablecoords.shape[1]
+
+        coords = np.concatenate([cable.cablecoords for cable in installation.cable_list], axis=1)
+
+        return coords, cableSlices
+
+    def influenceRow(self, coords, j):
+        """
+        Calculates (1/r+ - 1/r-) between point j and every point source in the coordinate array. The term of point j on
+        itself is zero, as in deltaTEqn.
+        :param coords: coordinate array from installationArrays()
+        :param j: index of the point
+        :return: numpy array of (1/r+ - 1/r-) for each point source
+        """
+        r_plus = np.sqrt((coords[0][j] - coords[0]) ** 2 + (coords[1][j] - coords[1]) ** 2 + (coords[2][j] - coords[2]) ** 2)
+        r_minus = np.sqrt((coords[0][j] - coords[0]) ** 2 + (coords[1][j] + coords[1]) ** 2 + (coords[2][j] - coords[2]) ** 2)
+
+        # Impact of the point on itself is set to zero
+        r_plus[j] = 1
+        r_minus[j] = 1
+
+        return 1 / r_plus - 1 / r_minus
+
+    def smoothedSourceMasks(self, cableSlices):
+        """
+        deltaTEqn smooths the short sections of cableI after the groups and the cables up to cableI in the cable list
+        have been added, so the cables after cableI are not smoothed. Finds which point sources are included in the
+        smoothed sum of each cable.
+        :param cableSlices: list of (cable, slice) pairs from installationArrays()
+        :return: dictionary of boolean numpy arrays, True for the point sources smoothed for the cable {cableID: array}
+        """
+        installation = self.installation
+        numPoints = cableSlices[-1][1].stop
+        masks = {}
+
+        for n, (cableI, sliceI) in enumerate(cableSlices):
+            mask = np.zeros(numPoints, dtype=bool)
+            for k, (cableJ, sliceJ) in enumerate(cableSlices):
+                # Conductors of other groups are added through their group, before the cable loop
+                otherGroup = (cableJ.group in installation.group_list and cableJ.group is not cableI.group
+                              and cableJ.group.sourcecoords is not None)
+                if k <= n or otherGroup:
+                    mask[sliceJ] = True
+            masks[cableI.cableID] = mask
+
+        return masks
+
+    def influenceTransposeEqn(self, coords, cableSlices, values):
+        """
+        Applies the transpose of the influence operator solved by deltaTEqn, including the short section smoothing of
+        the partial sums. Uses the exact conductor positions, so the equivalent sources of cable groups are not included.
+        (1/r+ - 1/r-) is symmetric, so each point adds its row times its value, and points with a zero value are skipped.
+        :param coords: coordinate array from installationArrays()
+        :param cableSlices: list of (cable, slice) pairs from installationArrays()
+        :param values: numpy array with a value for each point of the installation
+        :return: numpy array with the result at each point source
+        """
+        smoothed = self.smoothingEqn(cableSlices, values, transpose=True)
+        masks = self.smoothedSourceMasks(cableSlices)
+        result = np.zeros_like(values, dtype=np.float64)
+
+        for cable, cableSlice in cableSlices:
+            mask = masks[cable.cableID]
+            for j in range(cableSlice.start, cableSlice.stop):
+                if smoothed[j] == 0 and values[j] == 0:
+                    continue
+                result += self.influenceRow(coords, j) * np.where(mask, smoothed[j], values[j])
+
+        return result
+
+    def smoothingEqn(self, cableSlices, values, transpose=False):
+        """
+        Applies the small segment smoothing of deltaTEqn (the value of a short section is replaced with the average of
+        the two adjacent sections) to an array of values of all the cables in the installation.
+        :param cableSlices: list of (cable, slice) pairs from installationArrays()
+        :param values: numpy array with a value for each point of the installation
+        :param transpose: if True, applies the transpose of the smoothing. Used for adjoint calculations. default False
+        :return: smoothed numpy array
+        """
+        result = values.copy()
+
+        for cable, cableSlice in cableSlices:
+            cableValues = result[cableSlice]
+            smallSections = [i for i in range(cable.cablecoords.shape[1] - 1) if cable.cablecoords[3][i] < cable.deltaL]
+
+            if not transpose:
+                for i in smallSections:
+                    cableValues[i] = (cableValues[i - 1] + cableValues[i + 1]) / 2
+            else:
+                # The smoothing is applied one section at a time, so the transpose is applied in the reverse order
+                for i in reversed(smallSections):
+                    value = cableValues[i]
+                    cableValues[i] = 0
+                    cableValues[i - 1] += value / 2
+                    cableValues[i + 1] += value / 2
+
+        return result
+
+    def hotspot(self):
+        """
+        Finds the maximum section temperature of the installation.
+        :return: cable object, section index within the cable, point index within installationArrays()
+        """
+        coords, cableSlices = self.installationArrays()
+        temps = np.concatenate([cable.sectionCableTemp for cable in self.installation.cable_list])
+        m = int(np.argmax(temps))
+
+        for cable, cableSlice in cableSlices:
+            if cableSlice.start <= m < cableSlice.stop:
+                return cable, m - cableSlice.start, m
+
+    def hotspotAnalysis(self):
+        """
+        Breaks the maximum temperature of the installation down into the temperature increase caused by each cable.
+        Evaluated from the converged watt losses with a single row of the influence operator, no additional iterations
+        are required. The profile of a cable shows the increase caused by each of its point sources, which locates the
+        crossings or parallel runs driving the hotspot. The breakdown uses the exact conductor positions. The residual
+        is the part of the hotspot temperature not covered by the breakdown, mostly the difference of the cable group
+        equivalent sources used by deltaTEqn. It is zero without cable groups.
+        :return: dictionary with the hotspot cableID, section index, temperature, ambient temperature, contributions
+        {cableID: degC}, residual (degC) and profiles {cableID: numpy array of degC per point source}
+        """
+        coords, cableSlices = self.installationArrays()
+        hotCable, index, m = self.hotspot()
+        soil = self.installation.soil
+
+        # Row m of the influence operator, from its transpose applied to the unit vector
+        unit = np.zeros(coords.shape[1], dtype=np.float64)
+        unit[m] = 1
+        row = self.influenceTransposeEqn(coords, cableSlices, unit)
+
+        contributions = {}
+        profiles = {}
+        for cable, cableSlice in cableSlices:
+            profiles[cable.cableID] = row[cableSlice] * cable.cablecoords[3] * cable.sectionWattLosses / (4 * math.pi * (1 / soil.thermalResistivity))
+            contributions[cable.cableID] = np.sum(profiles[cable.cableID])
+
+        # Losses of the hotspot section through the cable layers and soil (first term of the temperature equation)
+        contributions[hotCable.cableID] += hotCable.sectionWattLosses[index] * hotCable.cablecoords[3][index] * (self.cableThermalResistance(hotCable) + soil.thermalResistivity)
+
+        temperature = hotCable.sectionCableTemp[index]
+        residual = temperature - self.installation.ambTemp - sum(contributions.values())
+
+        return {"cableID": hotCable.cableID, "index": index, "temperature": temperature,
+                "ambient": self.installation.ambTemp, "contributions": contributions, "residual": residual,
+                "profiles": profiles}
+
+    def sensitivityAnalysis(self, convReq=0.000001, maxIterations=200):
+        """
+        Calculates the derivatives of the maximum installation temperature with respect to the current of each cable and
+        to the soil thermal resistivity. The temperature equation is linearized around the converged temperatures and
+        watt losses, and a single adjoint system is solved by iteration for all of the derivatives. Each adjoint
+        iteration costs about one deltaTEqn iteration, instead of a full calculation per changed value. The adjoint uses
+        the exact conductor positions, so with cable groups the derivatives do not include the change of the group
+        equivalent source approximation.
+        :param convReq: Float value. Adjoint iteration stops when the relative change is less than the specified value. defaults to 0.000001
+        :param maxIterations: maximum number of adjoint iterations before the adjoint is treated as not converging. defaults to 200
+        :return: dictionary with the hotspot cableID, section index, temperature, current {cableID: degC/A} and
+        thermalResistivity (degC per K.m/W)
+        """
+        coords, cableSlices = self.installationArrays()
+        hotCable, index, m = self.hotspot()
+        soil = self.installation.soil
+        influenceFactor = 1 / (4 * math.pi * (1 / soil.thermalResistivity))
+
+        deltaL = coords[3]
+        wattLosses = np.concatenate([cable.sectionWattLosses for cable in self.installation.cable_list])
+
+        # Per section factors of the temperature equation
+        # localFactor: deltaL * (Tcab + T4), first term of the temperature equation
+        # lossDerivative: derivative of the section watt losses with respect to the section temperature
+        # currentDerivative: derivative of the section watt losses with respect to the cable current
+        localFactor = np.zeros_like(deltaL)
+        lossDerivative = np.zeros_like(deltaL)
+        currentDerivative = np.zeros_like(deltaL)
+        for cable, cableSlice in cableSlices:
+            localFactor[cableSlice] = cable.cablecoords[3] * (self.cableThermalResistance(cable) + soil.thermalResistivity)
+
+            resistancePlus = cable.updateResistance(cable.sectionCableTemp + 0.5)
+            resistanceMinus = cable.updateResistance(cable.sectionCableTemp - 0.5)
+            lossDerivative[cableSlice] = cable.current * cable.current * (resistancePlus - resistanceMinus)
+            currentDerivative[cableSlice] = 2 * cable.current * cable.updateResistance()
+
+        def adjointEqn(values):
+            # Transpose of the linear operator that maps section watt losses to section temperature increases
+            return localFactor * values + influenceFactor * deltaL * self.influenceTransposeEqn(coords, cableSlices, values)
+
+        # Solve adjoint = A^T (e_m + lossDerivative * adjoint), where e_m selects the hotspot section
+        unit = np.zeros(coords.shape[1], dtype=np.float64)
+        unit[m] = 1
+        hotspotRow = adjointEqn(unit)
+        adjoint = hotspotRow.copy()
+        converged = False
+        counter = 1
+        change = np.inf
+        growing = 0
+        while not converged:
+            if counter > maxIterations:
+                raise RuntimeError("Adjoint did not converge in " + str(maxIterations) + " iterations")
+            print("adjoint iteration: ", counter)
+            counter += 1
+
+            adjointNew = hotspotRow + adjointEqn(lossDerivative * adjoint)
+            if not np.all(np.isfinite(adjointNew)):
+                raise ValueError("Adjoint is not finite")
+
+            # The iteration diverges when the losses grow faster with temperature than the soil removes the heat
+            # (thermal runaway). The change then stops decreasing
+            previousChange = change
+            change = np.max(np.absolute(adjointNew - adjoint))
+            growing = growing + 1 if change >= previousChange else 0
+            if growing >= 3:
+                raise RuntimeError("Adjoint iteration is diverging. The installation may be in thermal runaway")
+
+            converged = change <= convReq * np.max(np.absolute(adjointNew))
+            adjoint = adjointNew
+
+        # Sensitivity of the hotspot temperature to the temperature increase of each section
+        temperatureWeight = unit + lossDerivative * adjoint
+
+        currentSensitivity = {}
+        for cable, cableSlice in cableSlices:
+            currentSensitivity[cable.cableID] = np.sum(adjoint[cableSlice] * currentDerivative[cableSlice])
+
+        # Derivative of the temperature increases with respect to the soil thermal resistivity at constant watt losses
+        # The influence term is proportional to the resistivity, and is taken from the calculated temperatures, so it
+        # includes the cable group equivalent sources as solved by deltaTEqn
+        sectionCableTemp = np.concatenate([cable.sectionCableTemp for cable in self.installation.cable_list])
+        influenceTemp = sectionCableTemp - self.installation.ambTemp - localFactor * wattLosses
+        resistivityDerivative = deltaL * wattLosses + influenceTemp / soil.thermalResistivity
+
+        return {"cableID": hotCable.cableID, "index": index, "temperature": hotCable.sectionCableTemp[index],
+                "current": currentSensitivity,
+                "thermalResistivity": np.sum(temperatureWeight * resistivityDerivative)}
+
     def plotResults(self):
         """
         Creates 3D plot of the thermal results calculation. Prints the max cable temperature of each cable.
@@ -1,4 +1,4 @@
-from CableInstallation import Installation, Cable
+from CableInstallation import Installation, Cable, CableGroup
 from CableTherm import CableThermalCalculation
 
 def parallel_cables():
@@ -55,6 +55,44 @@ def parallel_cables():
     #Plot temperature results of the thermal calculation
     calc.plotResults()
 
+def parallel_circuits():
+    #Same layout as parallel_cables, with each pair of conductors modeled as one circuit
+    #Create installation object
+    installation = Installation(ambTemp=30)
+    installation.soil.thermalResistivity = 3.5
+
+    # Circuit 1 conductors are modeled after the reference cable - PV-Solar 2kV 600 KCMIL cable
+    # Conductors are offset by one cable diameter along the x axis
+    circuit1 = CableGroup(groupID='circuit1', offsets=[(0, 0, 0), (0.02160, 0, 0)], current=300, deltaL=0.01,
+                          startx=0, starty=-0.77, startz=0, cableIDs=['cable2', 'cable3'], insulationTR=3.5,
+                          armorBeddingTR=0, jacketTR=0, sheathLossFactor=0, armorLossFactor=0, conductorMaterial="Al",
+                          insulationSystem="RoundStranded", conductorDiameter=0.02159,
+                          conductorDCResistance20=0.0000951443569553806,
+                          frequency=0)
+    circuit1.addSegment(0, -0.77, 50)
+
+    # Circuit 2 conductors are modeled after the reference cable - PV-Solar 2kV 600 KCMIL cable
+    circuit2 = CableGroup(groupID='circuit2', offsets=[(0, 0, 0), (0.02160, 0, 0)], current=300, deltaL=0.01,
+                          startx=0, starty=-1.07, startz=0, cableIDs=['cable4', 'cable5'], insulationTR=3.5,
+                          armorBeddingTR=0, jacketTR=0, sheathLossFactor=0, armorLossFactor=0, conductorMaterial="Al",
+                          insulationSystem="RoundStranded", conductorDiameter=0.02159,
+                          conductorDCResistance20=0.0000951443569553806,
+                          frequency=0)
+    circuit2.addSegment(0, -1.07, 50)
+
+    #add circuits to the installation
+    installation.addGroup(circuit1)
+    installation.addGroup(circuit2)
+
+    # Create 3D plot of the installation
+    installation.plot()
+
+    # Create a new calculation object
+    calc = CableThermalCalculation(installation,xOffset=0,yOffset=-0.05,zOffset=0)
+
+    #Plot temperature results of the thermal calculation
+    return calc.plotResults()
+
 def cable_crossing():
     #Create installation object
     installation = Installation(ambTemp=30)
@@ -116,8 +154,15 @@ def cable_crossing():
     # Create a new calculation object
     calc = CableThermalCalculation(installation,xOffset=0,yOffset=-0.05,zOffset=0)
 
+    #Break the hotspot temperature down by cable and calculate its sensitivity to the currents and soil
+    hotspot = calc.hotspotAnalysis()
+    print("Hotspot:", hotspot["cableID"], "Temp:", hotspot["temperature"], "Contributions:", hotspot["contributions"], "Residual:", hotspot["residual"])
+    sensitivity = calc.sensitivityAnalysis()
+    print("dTmax/dI:", sensitivity["current"], "dTmax/dRho:", sensitivity["thermalResistivity"])
+
     #Plot temperature results of the thermal calculation
     return calc.plotResults()
 
 #parallel_cables()
+#parallel_circuits()
 cable_crossing()
\ No newline at end of file